@@ -44,17 +44,16 @@ Extensions:
 
 __version__ = 0.1
 
-# Only depends upon the standard library in its basic form
-import string
-import webbrowser
+# Only depends upon the standard library in its basic form (modules that are
+# only needed for saving/downloading are imported when used)
 import time
 import os
+import sys
 import logging
 import re
-import SimpleHTTPServer
-import SocketServer
-import urllib2
 import hashlib
+import html
+from io import StringIO
 _logger = logging.getLogger(__name__)
 
 
@@ -66,61 +65,105 @@ _logger = logging.getLogger(__name__)
 #-------------------------------------------------------------------------------
 class RenderObject(object):
     """Abstract base class for everything that can be rendered"""
+    __slots__ = ()
 
-    def _render(self, level):
-        """Should return a string with HTML code of object"""
+    def _render(self, level, out):
+        """Should write HTML code of object to file-like `out`"""
         raise NotImplementedError()
 
+    def invalidate(self):
+        """Discard cached HTML code, e.g., after the object was modified"""
+        pass
+
 
 class Node(RenderObject):
     """Abstract base class for all classes that allow to add children"""
+    __slots__ = ("children",)
+
+    def __init__(self):
+        """Create node without children"""
+        self.children = []
 
     def add(self, child):
         """Add a single children to the node"""
-        if not hasattr(self, "children"):
-            self.children = []
         self.children.append(_parse_obj(child))
         return child
 
-    def _render_children(self, level):
-        """Render children and concatenate source"""
-        if not hasattr(self, "children"):
-            self.children = []
-        return "".join([i._render(level) for i in self.children])
+    def _render_children(self, level, out):
+        """Render children one after another to `out`"""
+        for c in self.children:
+            c._render(level, out)
+
+    def invalidate(self):
+        """Discard cached HTML code of node and all its children"""
+        for c in self.children:
+            c.invalidate()
 
 # Dispatch function
 #-------------------------------------------------------------------------------
+_DISPATCH = {}  # global to cache conversion functions per type
+
+
 def _parse_obj(obj):
     """Convert supported types into RenderObject otherwise throw error"""
+    t = type(obj)
+    convert = _DISPATCH.get(t)
+    if convert is None:
+        convert = _DISPATCH[t] = _find_conversion(obj)
+    return convert(obj)
+
+
+def _find_conversion(obj):
+    """Return function that converts `obj` into a RenderObject"""
+    # Optional libraries are never imported here: objects of their types can
+    # only exist if the library was loaded already, i.e., is in `sys.modules`
+    np = sys.modules.get("numpy")
+    pd = sys.modules.get("pandas")
+    go = sys.modules.get("plotly.graph_objs")
+    mpl_figure = sys.modules.get("matplotlib.figure")
     if isinstance(obj, RenderObject):
-        return obj
-    elif isinstance(obj, (basestring, int, float)):
-        return String(str(obj))
-    elif _NPY and isinstance(obj, np.ndarray):
-        return Array(obj)
-    elif _PDS and isinstance(obj, pd.core.frame.DataFrame):
-        return DFrame(obj)
-    elif _PLY and isinstance(obj, go.Figure):
-        return Plot(obj)
-    elif _MPL and isinstance(obj, matplotlib.figure.Figure):
-        return MPlot(obj)
+        return lambda o: o
+    elif isinstance(obj, (str, int, float)):
+        return lambda o: String(str(o))
+    elif np is not None and isinstance(obj, np.ndarray):
+        return Array
+    elif pd is not None and isinstance(obj, pd.DataFrame):
+        return DFrame
+    elif go is not None and isinstance(obj, go.Figure):
+        return Plot
+    elif mpl_figure is not None and isinstance(obj, mpl_figure.Figure):
+        return MPlot
     else:
         raise ValueError("Type '%s' not supported for rendering!" % type(obj))
 
 # Classes that allow children
 #-------------------------------------------------------------------------------
 
-# Regular expressions used for slugs
-_re1 = re.compile(r'[^\w\s-]')
-_re2 = re.compile(r'[\s]+')
+# Regular expressions used for slugs: runs of characters that are neither word
+# characters nor "-" are dropped, or replaced by "_" if they contain spaces
+_re_slug = re.compile(r'[^\w-]+')
+_re_space = re.compile(r'\s')
+
+
+def _slug_replace(match):
+    """Replacement for a single match of `_re_slug` in a title"""
+    if (match.start() == 0 or match.end() == len(match.string) or
+            not _re_space.search(match.group())):
+        return ""
+    return "_"
 
 
 class Report(Node):
-    """Main class that allows creating reports"""
+    """Main class that allows creating reports
+
+    Plots are only rendered once and reused by later calls of `to_html` and
+    `save`. Call `invalidate` after modifying figures that were already added.
+    """
+    __slots__ = ("title",)
 
     def __init__(self, title):
         """Create new report with the provided `title`"""
-        self.children=[]
+        Node.__init__(self)
         self.title = title
 
     def to_html(self, integrated=False):
@@ -132,11 +175,14 @@ class Report(Node):
 
         If the report should be saved to disk, use `save` method instead.
         """
-        return self._render(
-                integrated=integrated,
-                web=(not integrated),
-                local=False,
-            )
+        out = StringIO()
+        self._render(
+            out,
+            integrated=integrated,
+            web=(not integrated),
+            local=False,
+        )
+        return out.getvalue()
 
     def save(self, folder=None, filename=None, prefix=None, integrated=False,
              web=True, local=True, auto_open=True):
@@ -158,11 +204,10 @@ class Report(Node):
         # Folder
         if folder is None:
             folder = get_path()
-        if not os.path.exists(folder):
-            os.makedirs(folder)
+        os.makedirs(folder, exist_ok=True)
         # Path
         if filename is None:
-            filename = "%s.html" % _re2.sub('_', _re1.sub('', self.title).strip())
+            filename = "%s.html" % _re_slug.sub(_slug_replace, self.title)
         if prefix is None:
             prefix = time.strftime("%Y_%m_%d-%H_%M_%S-")
         path = os.path.join(folder, prefix + filename)
@@ -176,72 +221,81 @@ class Report(Node):
         # Create the report
         if local:
             _save_res(folder)        
-        with open(path, "w") as fout:
-            fout.write(self._render(
+        with open(path, "w", encoding="utf-8") as fout:
+            self._render(
+                fout,
                 integrated=integrated,
                 web=web,
                 local=local
-            ))
+            )
 
         # Auto-open
         if auto_open:
+            import webbrowser
             webbrowser.open("file://%s" % os.path.abspath(path))
         
         
-    def _render(self, integrated, web, local):
-        """Render the report to string"""
-        return _REPORT_TEMPLATE.substitute(
-            title=self.title,
-            content=self._render_children(1),
-            soft=__name__,
-            vers=__version__,
-            time=time.strftime("%c"),
-            header=_make_header(
-                integrated=integrated,
-                web=web,
-                local=local
-            )
-        )
+    def _render(self, out, integrated, web, local):
+        """Render the report to `out`"""
+        out.write(_REPORT_PARTS[0])
+        for name, part in zip(_REPORT_FIELDS, _REPORT_PARTS[1:]):
+            if name == "header":
+                _write_header(out, integrated=integrated, web=web, local=local)
+            elif name == "content":
+                self._render_children(1, out)
+            elif name == "title":
+                out.write(str(self.title))
+            elif name == "soft":
+                out.write(__name__)
+            elif name == "vers":
+                out.write(str(__version__))
+            elif name == "time":
+                out.write(time.strftime("%c"))
+            out.write(part)
 
     
 class Heading(Node):
     """HTML heading where level is automaticaly inferred"""
+    __slots__ = ("title",)
+
     def __init__(self, title):
         """Create new HTML Heading with content"""
+        Node.__init__(self)
         self.title = title
-        self.children = []
 
-    def _render(self, level):
-        return _HEADING_TEMPLATE.substitute(
-            title=self.title,
-            content=self._render_children(level + 1),
-            n=level)
+    def _render(self, level, out):
+        out.write("<div><h%d>%s</h%d>" % (level, self.title, level))
+        self._render_children(level + 1, out)
+        out.write("</div>")
 
 
 class Grid(Node):
     """Grid based on Bootstrap CSS"""
+    __slots__ = ("n_cols",)
+
     def __init__(self, n_cols=4):
         """Creates new grid
 
         Arguments:
           n_cols: (int in [1, 2, 3, 4, 6, 12]) Number of columns."""
-        self.children = []
+        Node.__init__(self)
         if n_cols not in [1, 2, 3, 4, 6, 12]:
             raise ValueError(
                 "Number of columns needs to be in [1, 2, 3, 4, 6, 12]!")
         self.n_cols = n_cols
 
-    def _render(self, level):
+    def _render(self, level, out):
         k = self.n_cols
-        r = []
+        n = len(self.children)
+        col = "<div class='col-md-%d'>" % (12 // k)
         for i, c in enumerate(self.children):
             if i % k == 0:
-                r.append("<div class='row'>")
-            r.append("<div class='col-md-%d'>%s</div>" %
-                     (12 / k, c._render(level)))
-            if (i + 1) % k == 0 or i + 1 == len(self.children):
-                r.append("</div>")
-        return "".join(r)
+                out.write("<div class='row'>")
+            out.write(col)
+            c._render(level, out)
+            out.write("</div>")
+            if (i + 1) % k == 0 or i + 1 == n:
+                out.write("</div>")
 
     
 # Classes that are final nodes
@@ -250,6 +304,7 @@ class Grid(Node):
 
 class String(RenderObject):
     """Simple string to render (doesn't escape)"""
+    __slots__ = ("_text",)
 
     def __init__(self, text):
         """Create object with HTML source `text`"""
@@ -257,38 +312,68 @@ class String(RenderObject):
             raise ValueError("Only strings are supported!")
         self._text = text
 
-    def _render(self, level):
-        return self._text
+    def _render(self, level, out):
+        out.write(self._text)
 
 
 class P(RenderObject):
     """Simple paragraph to render (doesn't escape)"""
+    __slots__ = ("_text",)
 
     def __init__(self, text):
         """Create paragraph with HTML source `text`"""
         self._text = _parse_obj(text)
 
-    def _render(self, level):
-        return "<p>%s</p>" % self._text._render(level)
+    def invalidate(self):
+        self._text.invalidate()
+
+    def _render(self, level, out):
+        out.write("<p>")
+        self._text._render(level, out)
+        out.write("</p>")
 
 
 class Dict(RenderObject):
     """Render dictionaries as HTML table"""
+    __slots__ = ("di",)
     def __init__(self, di):
         """Create Table of dictionary `di`"""
         self.di = di
 
-    def _render(self, level):
-        e = []
+    def _render(self, level, out):
+        out.write("<table class='%s'><tbody>" % _TABLE_CLS)
         for k, v in self.di.items():
-            e.append("<tr><th><b>%s</b></th><td>%s</td></tr>" %
-                     (str(k), str(v)))
-        return "<table class='%s'><tbody>%s</tbody></table>" % (_TABLE_CLS,
-                                                                "".join(e))
+            out.write("<tr><th><b>%s</b></th><td>%s</td></tr>" %
+                      (str(k), str(v)))
+        out.write("</tbody></table>")
+
+
+def _format_floats(a, fmt):
+    """Format float array `a` as rows of strings (NaNs as in pandas)"""
+    return [["NaN" if x != x else fmt % x for x in row] for row in a.tolist()]
+
+
+def _escape(a):
+    """Format array `a` as rows of HTML-escaped strings (as pandas does)"""
+    return [[html.escape(x, quote=False) for x in row]
+            for row in a.astype(str).tolist()]
+
+
+def _mask_rows(rows, mask):
+    """Replace cells of `rows` where boolean array `mask` is set by 'NaN'"""
+    return [["NaN" if m else x for x, m in zip(row, mrow)]
+            for row, mrow in zip(rows, mask.tolist())]
+
+
+def _render_rows(rows):
+    """Render rows of strings as HTML table rows"""
+    return "".join(["<tr><td>%s</td></tr>" % "</td><td>".join(row)
+                    for row in rows])
 
 
 class Array(RenderObject):
     """Render numpy arrays as HTML table"""
+    __slots__ = ("array", "max_cols", "max_rows")
     def __init__(self, array, max_cols=15, max_rows=50):
         """Create new HTML Table out of numpy array
 
@@ -301,69 +386,85 @@ class Array(RenderObject):
         self.max_cols = max_cols
         self.max_rows = max_rows
 
-    def _render(self, level):
+    def _render(self, level, out):
+        import numpy as np
         a = self.array
-        if a.ndim == 2 and _PDS:
-            df = pd.DataFrame(a[0:min(a.shape[0], self.max_rows), 0:min(
-                a.shape[1], self.max_cols)])
-            return "<div class='table-responsive'>%s</div>" % df.to_html(
-                classes=_TABLE_CLS,
-                index=False,
-                header=False,
-                float_format=lambda x: '%.2g' % x)
+        if a.ndim == 2:
+            a = a[:self.max_rows, :self.max_cols]
+            # Masked values are hidden as in pandas, so only the data is used
+            mask = np.ma.getmaskarray(a) if np.ma.isMaskedArray(a) else None
+            a = np.ma.getdata(a)
+            if np.issubdtype(a.dtype, np.floating):
+                rows = _format_floats(a, '%.2g')
+            elif a.dtype.kind in "OSU":
+                rows = _escape(a)
+            else:
+                rows = a.astype(str).tolist()
+            if mask is not None:
+                rows = _mask_rows(rows, mask)
+            out.write("<div class='table-responsive'><table class='%s'><tbody>"
+                      % _TABLE_CLS)
+            out.write(_render_rows(rows))
+            out.write("</tbody></table></div>")
         else:
-            return str(a)
+            out.write(str(a))
 
 
 class DFrame(RenderObject):
     """Render Pandas data frames as HTML table"""
+    __slots__ = ("df",)
 
     def __init__(self, df):
         """Create Pandas data frame out of  `df`"""
         self.df = df
 
-    def _render(self, level):
-        if _PDS:
-            return "<div class='table-responsive'>%s</div>" % self.df.to_html(
-                classes=_TABLE_CLS, float_format=lambda x: '%.3g' % x)
-        else:
-            return str(self.df)
+    def _render(self, level, out):
+        out.write("<div class='table-responsive'>%s</div>" %
+                  self.df.to_html(classes=_TABLE_CLS,
+                                  float_format=lambda x: '%.3g' % x))
 
 
 class Plot(RenderObject):
     """Class that renders plotly figures"""
+    __slots__ = ("fig", "_cached")
 
     def __init__(self, fig):
         """Create plot from plotly figure `fig`"""
         self.fig = fig
+        self._cached = None
 
-    def _render(self, level):
-        if _PLY:
-            return plotly.offline.plot(
-                self.fig,
-                output_type="div",
-                include_plotlyjs=False,
-                show_link=False)
-        else:
-            raise ImportError("Plotly library could not be loaded!")
+    def invalidate(self):
+        self._cached = None
+
+    def _render(self, level, out):
+        if self._cached is None:
+            plotly = _import_plotly()
+            self._cached = plotly.io.to_html(self.fig, **_PLOTLY_OPTIONS)
+        out.write(self._cached)
 
 
 class MPlot(RenderObject):
     """Class that renders plotly figures"""
+    __slots__ = ("fig", "_fig_plotly", "_cached")
 
     def __init__(self, fig):
         """Create plotly plot from matplotlib figure `fig`"""
         self.fig = fig
+        self._fig_plotly = None  # converted figure
+        self._cached = None
 
-    def _render(self, level):
-        if _PLY:
-            return plotly.offline.plot_mpl(
-                self.fig,
-                output_type="div",
-                include_plotlyjs=False,
-                show_link=False)
-        else:
-            raise ImportError("Plotly library could not be loaded!")
+    def invalidate(self):
+        self._fig_plotly = None
+        self._cached = None
+
+    def _render(self, level, out):
+        if self._cached is None:
+            plotly = _import_plotly()
+            if self._fig_plotly is None:
+                self._fig_plotly = plotly.tools.mpl_to_plotly(self.fig)
+            self._cached = plotly.io.to_html(self._fig_plotly,
+                                             **_PLOTLY_OPTIONS)
+        out.write(self._cached)
 
 
 ################################################################################
@@ -371,7 +472,7 @@ class MPlot(RenderObject):
 ################################################################################
 _TABLE_CLS = "table table-condensed table-striped table-hover table-bordered"
 
-_REPORT_TEMPLATE = string.Template("""
+_REPORT_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
   <head>
@@ -382,11 +483,11 @@ _REPORT_TEMPLATE = string.Template("""
       body {font-family: 'Raleway', sans-serif}
     </style>
     <script>
-        $$(function() {
+        $(function() {
             var navSelector = '#toc';
-            var $$myNav = $$(navSelector);
-            Toc.init($$myNav);
-            $$('body').scrollspy({
+            var $myNav = $(navSelector);
+            Toc.init($myNav);
+            $('body').scrollspy({
                 target: navSelector
             });
         });
@@ -410,10 +511,19 @@ _REPORT_TEMPLATE = string.Template("""
     </div>
   </body>
 </html>
-""")
+"""
+
+_re_field = re.compile(r'\$\{(\w+)\}')
+
+
+def _precompile_template(template):
+    """Split `template` into literal parts and the names of fields in between"""
+    parts = _re_field.split(template)
+    return parts[0::2], parts[1::2]
 
-_HEADING_TEMPLATE = string.Template(
-    "<div><h${n}>${title}</h${n}>${content}</div>")
+
+# Templates are split once so that rendering only writes parts and fields
+_REPORT_PARTS, _REPORT_FIELDS = _precompile_template(_REPORT_TEMPLATE)
 
 
 ################################################################################
@@ -439,6 +549,7 @@ def get_path():
 
 def open_path():
     """Open the default path to save reports"""
+    import webbrowser
     return webbrowser.open("file://%s" % os.path.abspath(get_path()))
 
 
@@ -459,99 +570,142 @@ _JS = [
 ]
 
 
-def _make_header(web, local, integrated):
-    """Automatically create header"""
-    res = []
-    for c in _CSS:
-        if local:
-            res.append('<link rel="stylesheet" href="%s">' % _res_filename(
-                c, "css"))
-        if web:
-            res.append('<link rel="stylesheet" href="%s">' % c)
-        if integrated:
-            res.append('<style type="text/css" media="screen">%s</style>' %
-                       _get_url(c))
-    for c in _JS:
-        if local:
-            res.append('<script src="%s"></script>' % _res_filename(c, "js"))
-        if web:
-            res.append('<script src="%s"></script>' % c)
-        if integrated:
-            res.append('<script>%s</script>' % _get_url(c))
-    return "".join(res)
+_HEADER_CACHE = {}  # global to cache links to ressources per (web, local)
+
+
+def _write_header(out, web, local, integrated):
+    """Automatically create header and write it to `out`
+
+    Links to web/local ressources are cached per combination of flags while
+    integrated ressources are written directly (they can be several MB)."""
+    key = (web, local)
+    if key not in _HEADER_CACHE:
+        res = []
+        for c in _CSS:
+            if local:
+                res.append('<link rel="stylesheet" href="%s">' %
+                           _RES_FILENAME[c])
+            if web:
+                res.append('<link rel="stylesheet" href="%s">' % c)
+        for c in _JS:
+            if local:
+                res.append('<script src="%s"></script>' % _RES_FILENAME[c])
+            if web:
+                res.append('<script src="%s"></script>' % c)
+        _HEADER_CACHE[key] = "".join(res)
+    out.write(_HEADER_CACHE[key])
+    if integrated:
+        for c in _CSS:
+            out.write('<style type="text/css" media="screen">')
+            out.write(_get_url(c))
+            out.write('</style>')
+        for c in _JS:
+            out.write('<script>')
+            out.write(_get_url(c))
+            out.write('</script>')
 
 
 def _save_res(folder):
     """Download ressources and save to local folder"""
-    for c in _CSS:
-        _save_single(folder, c, "css")
-    for c in _JS:
-        _save_single(folder, c, "js")
-
-
-def _save_single(folder, url, ext):
+    # Downloads are run in parallel, files are then written one by one
+    missing = [c for c in _CSS + _JS if c not in _CACHE]
+    if missing:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            list(executor.map(_get_url, missing))
+    os.makedirs(folder, exist_ok=True)
+    for c in _CSS + _JS:
+        _save_single(folder, c)
+
+
+def _save_single(folder, url):
     """Download a single ressource and save to local folder"""
-    if not os.path.exists(folder): os.mkdir(folder)
-    path = os.path.join(folder, _res_filename(url, ext))
+    path = os.path.join(folder, _RES_FILENAME[url])
     content = _get_url(url)
-    with open(path, "w") as fout:
+    with open(path, "w", encoding="utf-8") as fout:
         fout.write(content)
 
 
+def _url_hash(url):
+    """Returns md5 hash of `url`"""
+    return hashlib.md5(url.encode("utf-8")).hexdigest()
+
+
 def _res_filename(url, ext):
     """Returns filename for css/js ressource"""
-    return ".%s%s.%s" % (ext, hashlib.md5(_get_url(url)).hexdigest(), ext)
+    return ".%s%s.%s" % (ext, _url_hash(url), ext)
+
+
+# Filenames of ressources in local folder are fixed and hence computed once
+_RES_FILENAME = dict([(c, _res_filename(c, "css")) for c in _CSS] +
+                     [(c, _res_filename(c, "js")) for c in _JS])
 
 
 _CACHE = {} # global to cache url requests
 
+
+def _cache_dir():
+    """Get the folder to cache url requests across sessions"""
+    return os.path.expanduser(
+        os.environ.get("LWREPORT_CACHE", "~/.cache/lwreport/"))
+
+
 def _get_url(url):
-    """Cached retrival of URLs in one session"""
+    """Cached retrival of URLs in one session and on disk"""
     if not url in _CACHE:
-        _CACHE[url] = urllib2.urlopen(url).read()
+        path = os.path.join(_cache_dir(), _url_hash(url))
+        if os.path.exists(path):
+            with open(path, "rb") as fin:
+                content = fin.read()
+            try:
+                _CACHE[url] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                # Corrupt cache file: drop it and download again
+                _logger.warning("Removing corrupt cache file '%s'" % path)
+                os.remove(path)
+        if not url in _CACHE:
+            import urllib.request
+            content = urllib.request.urlopen(url).read()
+            # Decode before caching so that only valid content is kept
+            _CACHE[url] = content.decode("utf-8")
+            _write_cache(path, content)
     return _CACHE[url]
 
 
+def _write_cache(path, content):
+    """Save downloaded content to disk cache (failures are only logged)"""
+    # Write to temporary file first so that no partial file is cached
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as fout:
+            fout.write(content)
+        os.replace(tmp, path)
+    except OSError as e:
+        _logger.warning("Could not cache '%s': %s" % (path, e))
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+
 ################################################################################
-# Support different libraries if available, otherwise ignore gracefully
+# Support different libraries if available (only loaded when needed)
 ################################################################################
-# Matplotlib
-try:
-    _logger.debug("Trying to load Matplotlib!")
-    import matplotlib as mpl
-    import matplotlib.figure
-    _MPL = True
-except ImportError:
-    _logger.info("Matplotlib not available!")
-    _MPL = False
-
-# Plotly
-try:
-    _logger.debug("Trying to load plotly!")
-    import plotly
-    import plotly.graph_objs as go
-    _PLY = True
-except ImportError:
-    _logger.info("Plotly not available!")
-    _PLY = False
-
-# Numpy
-try:
-    _logger.debug("Trying to load numpy!")
-    import numpy as np
-    _NPY = True
-except ImportError:
-    _logger.info("Numpy not available!")
-    _NPY = False
-
-# Pandas
-try:
-    _logger.debug("Trying to load pandas!")
-    import pandas as pd
-    _PDS = True
-except ImportError:
-    _logger.info("Pandas not available!")
-    _PDS = False
+# Options to render plotly figures as divs (plotly.js is added by the header)
+_PLOTLY_OPTIONS = dict(include_plotlyjs=False, full_html=False)
+
+
+def _import_plotly():
+    """Import plotly (with `io` and `tools`) on first use"""
+    try:
+        import plotly.io
+        import plotly.tools
+    except ImportError:
+        raise ImportError("Plotly library could not be loaded!")
+    return plotly
 
 
 ################################################################################
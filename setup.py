@@ -4,6 +4,7 @@ setup(
     name='lwreport',
     version=0.1,
     py_modules=['lwreport', 'test_lwreport'],
+    python_requires='>=3.3',
     install_requires=[],
     extras_require={'all': all_deps},
     tests_require=["nose"] + all_deps,
@@ -22,8 +22,10 @@
 """
 Tests
 """
+import os
 import tempfile
 import shutil
+from io import StringIO
 from collections import OrderedDict
 import lwreport as lwr
 import numpy as np
@@ -91,7 +93,7 @@ def sample_report():
         title='Where is Switzerland?',
         geo=dict(
             scope='world',
-            projection=dict(type='Mercator'),
+            projection=dict(type='mercator'),
             showlakes=True,
             lakecolor='rgb(255, 255, 255)'), )
 
@@ -121,16 +123,64 @@ def test():
     """Test that tests and showcases full functionality"""
     report = sample_report()
     r = report.to_html()
+    cache = os.environ.get("LWREPORT_CACHE")
     try:
         d = tempfile.mkdtemp()
+        os.environ["LWREPORT_CACHE"] = os.path.join(d, "cache")
         report.save(folder=d, auto_open=False)
         report.save(folder=d, prefix="", auto_open=False)
         report.save(folder=d, filename="test", auto_open=False)
         report.save(folder=d, auto_open=False, web=False)
         report.save(folder=d, auto_open=False, integrated=True)
     finally:
+        if cache is None:
+            del os.environ["LWREPORT_CACHE"]
+        else:
+            os.environ["LWREPORT_CACHE"] = cache
         shutil.rmtree(d)
 
+def test_cache():
+    """Test that reports show changes while plots are only rendered once"""
+    report = lwr.Report("Cache")
+    h1 = report.add(lwr.Heading("Heading 1"))
+    h1.add(lwr.P("First"))
+    assert "First" in report.to_html()
+    h1.add(lwr.P("Second"))
+    h1.title = "Renamed"
+    di = {"Name": "James Bond"}
+    report.add(lwr.Dict(di))
+    di["Name"] = "Jason Bourne"
+    r = report.to_html()
+    assert "Second" in r and "Renamed" in r and "Jason Bourne" in r
+    plot = report.add(lwr.Plot(go.Figure(data=[go.Scatter(x=[1], y=[1])])))
+    div = _render(plot)
+    assert div == _render(plot) and div in report.to_html()
+    report.invalidate()
+    assert div != _render(plot)
+
+def _render(obj):
+    """Return HTML code of a single RenderObject"""
+    out = StringIO()
+    obj._render(1, out)
+    return out.getvalue()
+
+def test_array():
+    """Test that numpy arrays are rendered like pandas renders them"""
+    r = _render(lwr.Array(np.array([[1.23456, np.nan], [1e10, -0.5]])))
+    assert "<td>1.2</td><td>NaN</td></tr><tr><td>1e+10</td><td>-0.5</td>" in r
+    r = _render(lwr.Array(np.ma.masked_array([[1., 2.]], mask=[[0, 1]])))
+    assert "<td>1</td><td>NaN</td>" in r
+    r = _render(lwr.Array(np.ma.masked_array([["a", "b"]], mask=[[1, 0]])))
+    assert "<td>NaN</td><td>b</td>" in r
+    for a in [np.array([["<b>", "a&b"]]),
+              np.array([["<b>", "a&b"]], dtype=object)]:
+        r = _render(lwr.Array(a))
+        assert "<td>&lt;b&gt;</td><td>a&amp;b</td>" in r and "<b>" not in r
+
+def test_title():
+    """Test that non-string titles are rendered"""
+    assert "<title>2017</title>" in lwr.Report(2017).to_html()
+
 def gen_sample_report():
     """Create a sample report"""
     sample_report().save()